@@ -5,6 +5,7 @@ from telegram import (
     KeyboardButton,
     InlineKeyboardButton,
     InlineKeyboardMarkup,
+    InputFile,
     WebAppInfo,
 )
 from telegram.ext import (
@@ -16,19 +17,26 @@ from telegram.ext import (
     filters,
     ContextTypes,
 )
+import asyncio
+import contextlib
 import logging
-from io import BytesIO
-from sqlalchemy import select, delete
-from sqlalchemy.orm import selectinload
+import re
+import numpy as np
+from collections import OrderedDict
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import NamedTuple
+from sqlalchemy import select, insert, delete, func, bindparam, literal, text, Float, Integer
+from sqlalchemy.orm import defer, raiseload, undefer
 
 from src.config import settings
 from src.services.exif import get_exif_gps
-from src.services.clip_service import get_clip_service
+from src.services.clip_service import get_clip_service, run_clip
 from src.services.geocoding import get_location_from_gps, get_coords_from_zip
 from src.services.map_service import generate_stone_map_image
 from src.database.connection import async_session
 from src.database.models import Stone, StoneHistory
-from src.i18n import get_text, get_user_language, load_user_language, save_user_language, LANGUAGES
+from src.i18n import get_text, get_user_language, load_user_language, save_user_language, LANGUAGES, TEXTS
 
 logger = logging.getLogger(__name__)
 
@@ -40,34 +48,218 @@ WAITING_LOCATION = 3
 # Similarity threshold for finding existing stones
 SIMILARITY_THRESHOLD = 0.82
 
+# Candidates taken from the binary-quantized HNSW index, reranked by exact distance
+ANN_CANDIDATES = 50
+
 # Pagination settings
 STONES_PER_PAGE = 10
 
+# Mini App map page (settings are read once at startup; empty = no button)
+WEBAPP_MAP_URL = f"{settings.webapp_base_url}/static/index.html" if settings.webapp_base_url else ""
+
+# Accepted "skip" / "enter ZIP" inputs in WAITING_LOCATION (lowercase),
+# including the button texts of every language
+SKIP_VARIANTS = frozenset(
+    {"пропустить", "skip", "pomiń", "пропуск", "-", "нет", "no", "nie"}
+    | {TEXTS[lang]["btn_skip"].lower() for lang in LANGUAGES}
+)
+ZIP_VARIANTS = frozenset(
+    {"ввести zip код", "ввести zip", "zip", "zip код", "enter zip", "wpisz kod"}
+    | {TEXTS[lang]["btn_enter_zip"].lower() for lang in LANGUAGES}
+)
+
+# Looks like a ZIP code: 3-10 letters/digits/spaces/dashes, at least one alnum
+ZIP_CODE_RE = re.compile(r"(?=.*[^\W_])(?:[^\W_]|[ -]){3,10}")
+
+# Callback data patterns. Used as CallbackQueryHandler patterns, so malformed
+# data never reaches a handler and the parsed groups come from context.match
+LANG_CB_RE = re.compile(r"^lang:(\w+)$")
+MINE_PAGE_CB_RE = re.compile(r"^mine_page:(\d+)$")
+STONE_INFO_CB_RE = re.compile(r"^stone_info:(\d+)$")
+DELETE_ASK_CB_RE = re.compile(r"^delete_ask:(\d+)$")
+DELETE_CB_RE = re.compile(r"^(delete_confirm|delete_cancel):(\d+)$")
+
+# CLIP results for recently processed photos, keyed by Telegram file_unique_id
+# (same photo re-sent -> same id), so repeats skip download + rembg + CLIP
+PHOTO_CACHE_SIZE = 256
+_photo_cache: OrderedDict[str, dict] = OrderedDict()
+
+
+# Rendered history maps keyed by (stone_id, history length, newest history id):
+# a new sighting changes the key, so entries never go stale. Stored as
+# InputFile so a cached map is uploaded from the same buffer every time
+MAP_CACHE_SIZE = 64
+_map_cache: OrderedDict[tuple[int, int, int], InputFile] = OrderedDict()
+
+
+def _cache_photo_result(file_unique_id: str, result: dict) -> None:
+    """Store process_image result in LRU cache."""
+    _photo_cache[file_unique_id] = result
+    _photo_cache.move_to_end(file_unique_id)
+    if len(_photo_cache) > PHOTO_CACHE_SIZE:
+        _photo_cache.popitem(last=False)
+
+
+# Hot by-id SELECTs, built once at import: per-call values go in as bind
+# params, so every call reuses the same statement object and its entry in
+# the engine's compiled cache instead of rebuilding the query each time
+# Delete confirmation only shows the name: no Stone entity, no embedding
+_OWNED_STONE_NAME = (
+    select(Stone.name)
+    .where(Stone.id == bindparam("stone_id"))
+    .where(Stone.registered_by_user_id == bindparam("user_id"))
+)
+# Info card: the embedding is never displayed, don't fetch its 512 floats
+_STONE_WITH_HISTORY_COUNT = (
+    select(Stone)
+    .options(defer(Stone.embedding, raiseload=True), undefer(Stone.history_count), raiseload("*"))
+    .where(Stone.id == bindparam("stone_id"))
+)
+# Stone that already has this exact Telegram photo in its history
+_STONE_BY_PHOTO = (
+    select(Stone.id, Stone.name, Stone.description, Stone.history_count)
+    .where(
+        Stone.id == select(StoneHistory.stone_id)
+        .where(StoneHistory.photo_file_id == bindparam("photo_file_id"))
+        .limit(1)
+        .scalar_subquery()
+    )
+)
+_STONE_HISTORY = (
+    select(StoneHistory)
+    .options(raiseload("*"))
+    .where(StoneHistory.stone_id == bindparam("stone_id"))
+    .order_by(StoneHistory.created_at.desc())
+)
+
+
+# Nearest neighbour, built once so the SQL text is identical on every call
+# and asyncpg reuses its prepared statement. Raw SQL with text() and CAST()
+# to pass the vector parameter; the inner ORDER BY must match the
+# binary_quantize index expression, candidates are reranked by the
+# full-precision distance, which is also used for the threshold check.
+# Embeddings are unit length, so cosine distance = 1 - inner product
+# (<#> is the negative inner product: no norms computed per candidate).
+_NEAREST_STONE = (
+    text(f"""
+        SELECT id, distance FROM (
+            SELECT id, 1 + (embedding <#> CAST(:embedding AS vector)) AS distance
+            FROM stones
+            ORDER BY binary_quantize(embedding)::bit(512)
+                <~> binary_quantize(CAST(:embedding AS vector))
+            LIMIT {ANN_CANDIDATES}
+        ) candidates
+        ORDER BY distance
+        LIMIT 1
+    """)
+    .columns(id=Integer, distance=Float)
+    .subquery("nearest")
+)
+# Nearest stone's reply fields + history count + distance in one round-trip
+_SIMILAR_STONE = (
+    select(Stone.id, Stone.name, Stone.description, Stone.history_count, _NEAREST_STONE.c.distance)
+    .join(_NEAREST_STONE, Stone.id == _NEAREST_STONE.c.id)
+)
+
+
+async def _load_history(session, stone_id: int) -> list[StoneHistory]:
+    """Stone history rows, newest first, within the caller's session."""
+    result = await session.execute(_STONE_HISTORY, {"stone_id": stone_id})
+    return result.scalars().all()
+
+
+class StoneMatch(NamedTuple):
+    """Matched stone: just the columns the photo flow shows (plain row, no ORM instance)."""
+
+    id: int
+    name: str
+    description: str | None
+    history_count: int
+    similarity: float
+
+
+@dataclass(slots=True)
+class StoneDraft:
+    """Per-user conversation state between the photo and the location step."""
+
+    photo_file_id: str
+    embedding: np.ndarray | None  # None when the stone was found by photo_file_id
+    existing_stone: StoneMatch | None = None
+    name: str | None = None
+    description: str | None = None
+    latitude: float | None = None
+    longitude: float | None = None
+    zip_code: str | None = None
+    location: dict | None = None
+
+
+def get_draft(context: ContextTypes.DEFAULT_TYPE) -> StoneDraft:
+    """StoneDraft of the current conversation (set in handle_photo)."""
+    return context.user_data["draft"]
+
 
 def t(key: str, update: Update, **kwargs) -> str:
     """Shortcut for get_text with user_id from update."""
     return get_text(key, update.effective_user.id, **kwargs)
 
 
+# Language selection: LANGUAGES is static, so the markup is built once
+LANG_KEYBOARD = InlineKeyboardMarkup([
+    [InlineKeyboardButton(name, callback_data=f"lang:{code}")]
+    for code, name in LANGUAGES.items()
+])
+
+# Reply keyboards depend only on language; built once per language
+# (telegram objects are immutable, so sharing instances is safe)
+_location_keyboards: dict[str, ReplyKeyboardMarkup] = {}
+_skip_keyboards: dict[str, ReplyKeyboardMarkup] = {}
+
+
 def get_location_keyboard(user_id: int) -> ReplyKeyboardMarkup:
     """Get location keyboard with translated buttons."""
     lang = get_user_language(user_id)
-    btn_location = get_text("btn_send_location", user_id)
-    btn_zip = get_text("btn_enter_zip", user_id)
-    btn_skip = get_text("btn_skip", user_id)
-
-    return ReplyKeyboardMarkup(
-        [[KeyboardButton(btn_location, request_location=True)],
-         [btn_zip], [btn_skip]],
-        one_time_keyboard=True,
-        resize_keyboard=True,
-    )
+    keyboard = _location_keyboards.get(lang)
+    if keyboard is None:
+        btn_location = get_text("btn_send_location", user_id)
+        btn_zip = get_text("btn_enter_zip", user_id)
+        btn_skip = get_text("btn_skip", user_id)
+
+        keyboard = ReplyKeyboardMarkup(
+            [[KeyboardButton(btn_location, request_location=True)],
+             [btn_zip], [btn_skip]],
+            one_time_keyboard=True,
+            resize_keyboard=True,
+        )
+        _location_keyboards[lang] = keyboard
+    return keyboard
 
 
 def get_skip_keyboard(user_id: int) -> ReplyKeyboardMarkup:
     """Get skip keyboard with translated button."""
-    btn_skip = get_text("btn_skip", user_id)
-    return ReplyKeyboardMarkup([[btn_skip]], one_time_keyboard=True, resize_keyboard=True)
+    lang = get_user_language(user_id)
+    keyboard = _skip_keyboards.get(lang)
+    if keyboard is None:
+        btn_skip = get_text("btn_skip", user_id)
+        keyboard = ReplyKeyboardMarkup([[btn_skip]], one_time_keyboard=True, resize_keyboard=True)
+        _skip_keyboards[lang] = keyboard
+    return keyboard
+
+
+def format_stone_info(stone: Stone | StoneMatch, history_count: int, user_id: int) -> str:
+    """Stone info text: ID, name, description (if any), times seen."""
+    parts = [
+        get_text("stone_id", user_id, id=stone.id),
+        get_text("stone_name", user_id, name=stone.name),
+    ]
+    if stone.description:
+        parts.append(get_text("stone_description", user_id, description=stone.description))
+    parts.append(get_text("stone_seen", user_id, count=history_count))
+    return "\n".join(parts)
+
+
+def format_location(loc: dict) -> str:
+    """Geocoding result as "city, zip, country" (missing parts skipped)."""
+    return ", ".join(filter(None, (loc.get("city"), loc.get("zip_code"), loc.get("country"))))
 
 
 async def start_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -85,14 +277,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 async def lang_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle /lang command - show language selection."""
     await load_user_language(update.effective_user.id)
-    keyboard = []
-    for code, name in LANGUAGES.items():
-        keyboard.append([InlineKeyboardButton(name, callback_data=f"lang:{code}")])
-
-    await update.message.reply_text(
-        t("lang_select", update),
-        reply_markup=InlineKeyboardMarkup(keyboard)
-    )
+    await update.message.reply_text(t("lang_select", update), reply_markup=LANG_KEYBOARD)
 
 
 async def lang_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -100,7 +285,7 @@ async def lang_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     query = update.callback_query
     await query.answer()
 
-    lang_code = query.data.split(":")[1]
+    lang_code = context.match.group(1)
     await save_user_language(update.effective_user.id, lang_code)
 
     await query.edit_message_text(get_text("lang_changed", update.effective_user.id))
@@ -115,32 +300,34 @@ async def mine_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 async def show_my_stones(update: Update, page: int = 0, edit_message: bool = False) -> None:
     """Show user's stones with pagination."""
     user_id = update.effective_user.id
+    # Pagination edits the list message in place, /mine sends a new one
+    send = update.callback_query.edit_message_text if edit_message else update.message.reply_text
 
     try:
         async with async_session() as session:
-            result = await session.execute(
-                select(Stone)
-                .options(selectinload(Stone.history))
+            total_stones = await session.scalar(
+                select(func.count())
+                .select_from(Stone)
                 .where(Stone.registered_by_user_id == user_id)
-                .order_by(Stone.id)
             )
-            stones = result.scalars().all()
-
-            if not stones:
-                text = get_text("no_stones", user_id)
-                if edit_message:
-                    await update.callback_query.edit_message_text(text)
-                else:
-                    await update.message.reply_text(text)
+
+            if not total_stones:
+                await send(get_text("no_stones", user_id))
                 return
 
-            total_stones = len(stones)
             total_pages = (total_stones + STONES_PER_PAGE - 1) // STONES_PER_PAGE
             page = max(0, min(page, total_pages - 1))
 
-            start_idx = page * STONES_PER_PAGE
-            end_idx = min(start_idx + STONES_PER_PAGE, total_stones)
-            page_stones = stones[start_idx:end_idx]
+            # Only the current page and only the columns on the buttons
+            # (no ORM instances, no 512-dim embeddings); history as a count
+            result = await session.execute(
+                select(Stone.id, Stone.name, Stone.history_count)
+                .where(Stone.registered_by_user_id == user_id)
+                .order_by(Stone.id)
+                .limit(STONES_PER_PAGE)
+                .offset(page * STONES_PER_PAGE)
+            )
+            page_stones = result.all()
 
             # Header and page info only (stone info is on buttons)
             lines = [
@@ -151,11 +338,10 @@ async def show_my_stones(update: Update, page: int = 0, edit_message: bool = Fal
 
             # Build keyboard: single wide info button, no padding
             keyboard = []
-            for stone in page_stones:
-                history_count = len(stone.history)
-                button_text = f"📋 #{stone.id} {stone.name} ({history_count})"
+            for stone_id, name, history_count in page_stones:
+                button_text = f"📋 #{stone_id} {name} ({history_count})"
                 keyboard.append([
-                    InlineKeyboardButton(button_text, callback_data=f"stone_info:{stone.id}"),
+                    InlineKeyboardButton(button_text, callback_data=f"stone_info:{stone_id}"),
                 ])
 
             # Navigation buttons
@@ -175,24 +361,11 @@ async def show_my_stones(update: Update, page: int = 0, edit_message: bool = Fal
 
             reply_markup = InlineKeyboardMarkup(keyboard) if keyboard else None
 
-            if edit_message:
-                await update.callback_query.edit_message_text(
-                    "\n".join(lines),
-                    reply_markup=reply_markup
-                )
-            else:
-                await update.message.reply_text(
-                    "\n".join(lines),
-                    reply_markup=reply_markup
-                )
+            await send("\n".join(lines), reply_markup=reply_markup)
 
     except Exception as e:
-        logger.error(f"Error in show_my_stones: {e}", exc_info=True)
-        text = get_text("error_generic", user_id)
-        if edit_message:
-            await update.callback_query.edit_message_text(text)
-        else:
-            await update.message.reply_text(text)
+        logger.error("Error in show_my_stones: %s", e, exc_info=True)
+        await send(get_text("error_generic", user_id))
 
 
 async def mine_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -200,62 +373,61 @@ async def mine_page_callback(update: Update, context: ContextTypes.DEFAULT_TYPE)
     query = update.callback_query
     await query.answer()
 
-    page = int(query.data.split(":")[1])
+    page = int(context.match.group(1))
     await show_my_stones(update, page=page, edit_message=True)
 
 
+async def render_stone(message, user_id: int, stone_id: int, include_delete_button: bool = False) -> None:
+    """Reply with stone info (photo + text) and its history map."""
+    async with async_session() as session:
+        result = await session.execute(_STONE_WITH_HISTORY_COUNT, {"stone_id": stone_id})
+        stone = result.scalar_one_or_none()
+
+        # History rows are only needed for the map: load them in the same
+        # session, and skip the query when there are none
+        history = await _load_history(session, stone_id) if stone and stone.history_count else []
+
+    if not stone:
+        await message.reply_text(get_text("info_not_found", user_id, id=stone_id))
+        return
+
+    info_text = format_stone_info(stone, stone.history_count, user_id)
+
+    # Delete button for stone owner
+    delete_button = None
+    if include_delete_button and stone.registered_by_user_id == user_id:
+        delete_button = InlineKeyboardMarkup([[
+            InlineKeyboardButton(
+                get_text("btn_delete", user_id),
+                callback_data=f"delete_ask:{stone.id}"
+            )
+        ]])
+
+    if stone.photo_file_id:
+        await message.reply_photo(
+            photo=stone.photo_file_id,
+            caption=info_text,
+            reply_markup=delete_button
+        )
+    else:
+        await message.reply_text(info_text, reply_markup=delete_button)
+
+    if history:
+        await _send_stone_map_impl(message, user_id, stone, history)
+
+
 async def stone_info_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handle stone info callback from /mine list."""
     query = update.callback_query
     await query.answer()
 
     user_id = update.effective_user.id
-    stone_id = int(query.data.split(":")[1])
+    stone_id = int(context.match.group(1))
 
     try:
-        async with async_session() as session:
-            result = await session.execute(
-                select(Stone)
-                .options(selectinload(Stone.history))
-                .where(Stone.id == stone_id)
-            )
-            stone = result.scalar_one_or_none()
-
-            if not stone:
-                await query.message.reply_text(get_text("info_not_found", user_id, id=stone_id))
-                return
-
-            history_count = len(stone.history)
-            info_text = get_text("stone_id", user_id, id=stone.id) + "\n"
-            info_text += get_text("stone_name", user_id, name=stone.name) + "\n"
-            if stone.description:
-                info_text += get_text("stone_description", user_id, description=stone.description) + "\n"
-            info_text += get_text("stone_seen", user_id, count=history_count)
-
-            # Delete button for stone owner
-            delete_button = None
-            if stone.registered_by_user_id == user_id:
-                delete_button = InlineKeyboardMarkup([[
-                    InlineKeyboardButton(
-                        get_text("btn_delete", user_id),
-                        callback_data=f"delete_ask:{stone.id}"
-                    )
-                ]])
-
-            if stone.photo_file_id:
-                await query.message.reply_photo(
-                    photo=stone.photo_file_id,
-                    caption=info_text,
-                    reply_markup=delete_button
-                )
-            else:
-                await query.message.reply_text(info_text, reply_markup=delete_button)
-
-            if stone.history:
-                await send_stone_map_from_query(query, stone.id)
-
+        await render_stone(query.message, user_id, stone_id, include_delete_button=True)
     except Exception as e:
-        logger.error(f"Error in stone_info_callback: {e}", exc_info=True)
+        logger.error("Error in stone_info_callback: %s", e, exc_info=True)
         await query.message.reply_text(get_text("error_generic", user_id))
 
 
@@ -275,38 +447,9 @@ async def info_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
         return
 
     try:
-        async with async_session() as session:
-            result = await session.execute(
-                select(Stone)
-                .options(selectinload(Stone.history))
-                .where(Stone.id == stone_id)
-            )
-            stone = result.scalar_one_or_none()
-
-            if not stone:
-                await update.message.reply_text(t("info_not_found", update, id=stone_id))
-                return
-
-            history_count = len(stone.history)
-            info_text = t("stone_id", update, id=stone.id) + "\n"
-            info_text += t("stone_name", update, name=stone.name) + "\n"
-            if stone.description:
-                info_text += t("stone_description", update, description=stone.description) + "\n"
-            info_text += t("stone_seen", update, count=history_count)
-
-            if stone.photo_file_id:
-                await update.message.reply_photo(
-                    photo=stone.photo_file_id,
-                    caption=info_text
-                )
-            else:
-                await update.message.reply_text(info_text)
-
-            if stone.history:
-                await send_stone_map(update, stone.id)
-
+        await render_stone(update.message, user_id, stone_id)
     except Exception as e:
-        logger.error(f"Error in info_command: {e}", exc_info=True)
+        logger.error("Error in info_command: %s", e, exc_info=True)
         await update.message.reply_text(t("error_generic", update))
 
 
@@ -329,13 +472,11 @@ async def delete_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     try:
         async with async_session() as session:
             result = await session.execute(
-                select(Stone)
-                .where(Stone.id == stone_id)
-                .where(Stone.registered_by_user_id == user_id)
+                _OWNED_STONE_NAME, {"stone_id": stone_id, "user_id": user_id}
             )
-            stone = result.scalar_one_or_none()
+            name = result.scalar_one_or_none()
 
-            if not stone:
+            if name is None:
                 await update.message.reply_text(t("delete_not_found", update, id=stone_id))
                 return
 
@@ -354,12 +495,12 @@ async def delete_command(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
             ])
 
             await update.message.reply_text(
-                t("delete_confirm", update, name=stone.name, id=stone_id),
+                t("delete_confirm", update, name=name, id=stone_id),
                 reply_markup=keyboard
             )
 
     except Exception as e:
-        logger.error(f"Error in delete_command: {e}", exc_info=True)
+        logger.error("Error in delete_command: %s", e, exc_info=True)
         await update.message.reply_text(t("error_generic", update))
 
 
@@ -368,19 +509,17 @@ async def delete_ask_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
     query = update.callback_query
     await query.answer()
 
-    stone_id = int(query.data.split(":")[1])
+    stone_id = int(context.match.group(1))
     user_id = update.effective_user.id
 
     try:
         async with async_session() as session:
             result = await session.execute(
-                select(Stone)
-                .where(Stone.id == stone_id)
-                .where(Stone.registered_by_user_id == user_id)
+                _OWNED_STONE_NAME, {"stone_id": stone_id, "user_id": user_id}
             )
-            stone = result.scalar_one_or_none()
+            name = result.scalar_one_or_none()
 
-            if not stone:
+            if name is None:
                 await query.message.reply_text(get_text("delete_not_found", user_id, id=stone_id))
                 return
 
@@ -399,12 +538,12 @@ async def delete_ask_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
             ])
 
             await query.message.reply_text(
-                get_text("delete_confirm", user_id, name=stone.name, id=stone_id),
+                get_text("delete_confirm", user_id, name=name, id=stone_id),
                 reply_markup=keyboard
             )
 
     except Exception as e:
-        logger.error(f"Error in delete_ask_callback: {e}", exc_info=True)
+        logger.error("Error in delete_ask_callback: %s", e, exc_info=True)
         await query.message.reply_text(get_text("error_generic", user_id))
 
 
@@ -413,8 +552,8 @@ async def delete_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     query = update.callback_query
     await query.answer()
 
-    action, stone_id_str = query.data.split(":")
-    stone_id = int(stone_id_str)
+    action = context.match.group(1)
+    stone_id = int(context.match.group(2))
     user_id = update.effective_user.id
 
     if action == "delete_cancel":
@@ -424,120 +563,146 @@ async def delete_callback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     # Confirm deletion
     try:
         async with async_session() as session:
+            # Ownership check + delete in one statement; history is removed
+            # by ON DELETE CASCADE
             result = await session.execute(
-                select(Stone)
+                delete(Stone)
                 .where(Stone.id == stone_id)
                 .where(Stone.registered_by_user_id == user_id)
+                .returning(Stone.name)
             )
-            stone = result.scalar_one_or_none()
+            stone_name = result.scalar_one_or_none()
+            await session.commit()
 
-            if not stone:
+            if stone_name is None:
                 await query.edit_message_text(get_text("delete_not_found", user_id, id=stone_id))
                 return
 
-            stone_name = stone.name
-
-            # Delete history first (foreign key constraint)
-            await session.execute(
-                delete(StoneHistory).where(StoneHistory.stone_id == stone_id)
-            )
-
-            # Delete stone
-            await session.execute(
-                delete(Stone).where(Stone.id == stone_id)
-            )
-
-            await session.commit()
-
             await query.edit_message_text(get_text("delete_success", user_id, name=stone_name))
-            logger.info(f"User {user_id} deleted stone {stone_id} ({stone_name})")
+            logger.info("User %s deleted stone %s (%s)", user_id, stone_id, stone_name)
 
     except Exception as e:
-        logger.error(f"Error in delete_callback: {e}", exc_info=True)
+        logger.error("Error in delete_callback: %s", e, exc_info=True)
         await query.edit_message_text(get_text("error_generic", user_id))
 
 
+async def _download_photo(context: ContextTypes.DEFAULT_TYPE, file_id: str) -> bytearray:
+    """Download photo from Telegram."""
+    file = await context.bot.get_file(file_id)
+    # bytearray is bytes-like: PIL reads it through BytesIO, no copy needed
+    return await file.download_as_bytearray()
+
+
 async def handle_photo(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle photo message - detect stone, search or register."""
+    analyzing_task = None
     try:
         context.user_data.clear()
         await load_user_language(update.effective_user.id)
 
-        await update.message.reply_text(t("analyzing", update))
+        # "Analyzing" is sent in the background while the photo is downloaded
+        # and processed; awaited before any further reply to keep order
+        analyzing_task = asyncio.create_task(update.message.reply_text(t("analyzing", update)))
 
         photo = update.message.photo[-1]
-        file = await context.bot.get_file(photo.file_id)
-        image_bytes = bytes(await file.download_as_bytearray())
-        logger.info(f"Downloaded photo: {len(image_bytes)} bytes")
+        result = _photo_cache.get(photo.file_unique_id)
+
+        # Forwarded/re-sent photo already registered: exact file_id match,
+        # skips download, rembg, CLIP and the ANN search. No "cropped stone"
+        # thumbnail here: nothing was cropped, that reply only shows what
+        # the recognition ran on
+        if result is None:
+            known_stone = await find_stone_by_photo(photo.file_id)
+            if known_stone:
+                logger.info("Photo %s already in history of stone %s", photo.file_unique_id, known_stone.id)
+                await analyzing_task
+                context.user_data["draft"] = StoneDraft(
+                    photo_file_id=photo.file_id,
+                    embedding=None,
+                    existing_stone=known_stone,
+                )
+                return await reply_stone_found(update, known_stone)
 
-        clip = get_clip_service()
-        crop_result = clip.smart_crop_stone(image_bytes)
+        if result is not None:
+            _photo_cache.move_to_end(photo.file_unique_id)
+            logger.info("Photo %s already processed, using cached result", photo.file_unique_id)
+        else:
+            image_bytes = await _download_photo(context, photo.file_id)
+            logger.info("Downloaded photo: %s bytes", len(image_bytes))
+
+            result = await run_clip(get_clip_service().process_image, image_bytes)
+            if result is not None:
+                _cache_photo_result(photo.file_unique_id, result)
+
+        await analyzing_task
 
-        if crop_result is None:
+        if result is None:
             await update.message.reply_text(t("stone_not_found", update))
             return ConversationHandler.END
 
-        cropped_bytes, thumbnail_bytes = crop_result
-
-        is_stone, confidence = clip.is_stone(cropped_bytes)
-        logger.info(f"Stone detection: is_stone={is_stone}, confidence={confidence:.4f}")
+        thumbnail_bytes = result["thumbnail_bytes"]
+        is_stone, confidence = result["is_stone"], result["confidence"]
+        logger.info("Stone detection: is_stone=%s, confidence=%.4f", is_stone, confidence)
 
         if not is_stone:
             await update.message.reply_text(t("stone_not_recognized", update))
             return ConversationHandler.END
 
-        embedding = clip.get_embedding(cropped_bytes)
-        logger.info(f"Generated embedding: {len(embedding)} dimensions")
+        embedding = result["embedding"]
+        logger.info("Generated embedding: %s dimensions", len(embedding))
 
-        existing_stone = await find_similar_stone(embedding)
+        # The cropped thumbnail doesn't depend on the match: upload it while
+        # the similarity search runs. Same photo processed before -> thumbnail
+        # already on Telegram servers, send its file_id instead of the bytes
+        sent, existing_stone = await asyncio.gather(
+            update.message.reply_photo(
+                photo=result.get("thumbnail_file_id") or InputFile(thumbnail_bytes, filename="stone.jpg"),
+                caption=t("cropped_stone", update)
+            ),
+            find_similar_stone(embedding),
+        )
+        result["thumbnail_file_id"] = sent.photo[-1].file_id
 
-        context.user_data["photo_file_id"] = photo.file_id
-        context.user_data["embedding"] = embedding
-        context.user_data["thumbnail_bytes"] = thumbnail_bytes
-        context.user_data["latitude"] = None
-        context.user_data["longitude"] = None
-        context.user_data["zip_code"] = None
-        context.user_data["location"] = None
+        context.user_data["draft"] = StoneDraft(
+            photo_file_id=photo.file_id,
+            embedding=embedding,
+            existing_stone=existing_stone,
+        )
 
         if existing_stone:
-            context.user_data["found_stone_id"] = existing_stone.id
-            context.user_data["existing_stone"] = existing_stone
-
-            history_count = len(existing_stone.history)
-            info_text = t("stone_found", update) + "\n\n"
-            info_text += t("stone_id", update, id=existing_stone.id) + "\n"
-            info_text += t("stone_name", update, name=existing_stone.name) + "\n"
-            if existing_stone.description:
-                info_text += t("stone_description", update, description=existing_stone.description) + "\n"
-            info_text += t("stone_seen", update, count=history_count)
-            info_text += t("send_location_prompt", update)
-
-            await update.message.reply_photo(
-                photo=BytesIO(thumbnail_bytes),
-                caption=t("cropped_stone", update)
-            )
-
-            await update.message.reply_text(
-                info_text,
-                reply_markup=get_location_keyboard(update.effective_user.id)
-            )
-            return WAITING_LOCATION
+            return await reply_stone_found(update, existing_stone)
         else:
-            await update.message.reply_photo(
-                photo=BytesIO(thumbnail_bytes),
-                caption=t("cropped_stone", update)
-            )
             await update.message.reply_text(
                 t("new_stone", update) + "\n\n" + t("enter_name", update)
             )
             return WAITING_NAME
 
     except Exception as e:
-        logger.error(f"Error in handle_photo: {e}", exc_info=True)
+        logger.error("Error in handle_photo: %s", e, exc_info=True)
+        # Let "Analyzing" land (or fail quietly) before the error reply
+        if analyzing_task is not None:
+            with contextlib.suppress(Exception):
+                await analyzing_task
         await update.message.reply_text(t("error_photo", update))
         return ConversationHandler.END
 
 
+async def reply_stone_found(update: Update, stone: StoneMatch) -> int:
+    """Show the matched stone and ask for location of this sighting."""
+    info_text = "".join((
+        t("stone_found", update),
+        "\n\n",
+        format_stone_info(stone, stone.history_count, update.effective_user.id),
+        t("send_location_prompt", update),
+    ))
+
+    await update.message.reply_text(
+        info_text,
+        reply_markup=get_location_keyboard(update.effective_user.id)
+    )
+    return WAITING_LOCATION
+
+
 async def handle_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle stone name input."""
     name = update.message.text.strip()
@@ -546,7 +711,7 @@ async def handle_name(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int
         await update.message.reply_text(t("name_too_short", update))
         return WAITING_NAME
 
-    context.user_data["name"] = name
+    get_draft(context).name = name
     await update.message.reply_text(
         t("add_description", update, name=name),
         reply_markup=get_skip_keyboard(update.effective_user.id),
@@ -560,7 +725,7 @@ async def handle_description(update: Update, context: ContextTypes.DEFAULT_TYPE)
     btn_skip = get_text("btn_skip", update.effective_user.id)
 
     description = None if text == btn_skip else text
-    context.user_data["description"] = description
+    get_draft(context).description = description
 
     await update.message.reply_text(
         t("send_location_prompt", update).strip(),
@@ -572,63 +737,44 @@ async def handle_description(update: Update, context: ContextTypes.DEFAULT_TYPE)
 async def handle_location(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle location message."""
     try:
+        draft = get_draft(context)
         location = update.message.location
 
         if location:
             lat, lon = location.latitude, location.longitude
-            context.user_data["latitude"] = lat
-            context.user_data["longitude"] = lon
-            logger.info(f"Received location: {lat}, {lon}")
+            draft.latitude = lat
+            draft.longitude = lon
+            logger.info("Received location: %s, %s", lat, lon)
 
-            try:
-                geo_data = await get_location_from_gps(lat, lon)
-                if geo_data:
-                    context.user_data["zip_code"] = geo_data.get("zip_code")
-                    context.user_data["location"] = geo_data
-            except Exception as e:
-                logger.error(f"Geocoding failed: {e}")
+            # Geocode first (results are cached) so the ZIP code goes into
+            # the same INSERT as the sighting
+            await geocode_into_draft(draft)
 
-        existing_stone = context.user_data.get("existing_stone")
+        existing_stone = draft.existing_stone
 
         if existing_stone:
-            await add_to_history(
-                stone_id=existing_stone.id,
-                user_id=update.effective_user.id,
-                photo_file_id=context.user_data["photo_file_id"],
-                latitude=context.user_data.get("latitude"),
-                longitude=context.user_data.get("longitude"),
-                zip_code=context.user_data.get("zip_code"),
-            )
-            logger.info(f"Added to history for stone_id={existing_stone.id}")
-
             msg = t("saved_to_history", update)
-            if context.user_data.get("location"):
-                loc = context.user_data["location"]
-                loc_str = ""
-                if loc.get("city"):
-                    loc_str += loc["city"]
-                if loc.get("zip_code"):
-                    loc_str += f", {loc['zip_code']}"
-                if loc.get("country"):
-                    loc_str += f", {loc['country']}"
+            if draft.location:
+                loc_str = format_location(draft.location)
                 msg = t("location_label", update, location=loc_str) + "\n" + msg
 
-            await update.message.reply_text(msg, reply_markup=ReplyKeyboardRemove())
-            await send_stone_map(update, existing_stone.id)
+            history = await add_to_history(
+                stone_id=existing_stone.id,
+                user_id=update.effective_user.id,
+                photo_file_id=draft.photo_file_id,
+                latitude=draft.latitude,
+                longitude=draft.longitude,
+                zip_code=draft.zip_code,
+            )
+            logger.info("Added to history for stone_id=%s", existing_stone.id)
+            await reply_with_stone_map(update, msg, existing_stone, history)
         else:
-            stone_id = await register_stone(context.user_data, update.effective_user.id)
-            logger.info(f"Registered new stone: {context.user_data['name']} (ID: {stone_id})")
-
-            msg = t("stone_registered", update, name=context.user_data['name'], id=stone_id)
-            if context.user_data.get("location"):
-                loc = context.user_data["location"]
-                loc_str = ""
-                if loc.get("city"):
-                    loc_str += loc["city"]
-                if loc.get("zip_code"):
-                    loc_str += f", {loc['zip_code']}"
-                if loc.get("country"):
-                    loc_str += f", {loc['country']}"
+            stone_id = await register_stone(draft, update.effective_user.id)
+            logger.info("Registered new stone: %s (ID: %s)", draft.name, stone_id)
+
+            msg = t("stone_registered", update, name=draft.name, id=stone_id)
+            if draft.location:
+                loc_str = format_location(draft.location)
                 msg += "\n" + t("location_label", update, location=loc_str)
 
             await update.message.reply_text(msg, reply_markup=ReplyKeyboardRemove())
@@ -636,7 +782,7 @@ async def handle_location(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return ConversationHandler.END
 
     except Exception as e:
-        logger.error(f"Error in handle_location: {e}", exc_info=True)
+        logger.error("Error in handle_location: %s", e, exc_info=True)
         await update.message.reply_text(
             t("error_generic", update),
             reply_markup=ReplyKeyboardRemove()
@@ -644,35 +790,43 @@ async def handle_location(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         return ConversationHandler.END
 
 
+async def geocode_into_draft(draft: StoneDraft) -> None:
+    """Reverse-geocode draft.latitude/longitude into zip_code and location."""
+    try:
+        geo_data = await get_location_from_gps(draft.latitude, draft.longitude)
+        if geo_data:
+            draft.zip_code = geo_data.get("zip_code")
+            draft.location = geo_data
+    except Exception as e:
+        logger.error("Geocoding failed: %s", e)
+
+
 async def handle_skip_location(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Handle skip location button."""
     try:
-        existing_stone = context.user_data.get("existing_stone")
+        draft = get_draft(context)
+        existing_stone = draft.existing_stone
 
         if existing_stone:
-            await add_to_history(
+            history = await add_to_history(
                 stone_id=existing_stone.id,
                 user_id=update.effective_user.id,
-                photo_file_id=context.user_data["photo_file_id"],
-            )
-            logger.info(f"Added to history (no location) for stone_id={existing_stone.id}")
-            await update.message.reply_text(
-                t("saved_no_location", update),
-                reply_markup=ReplyKeyboardRemove(),
+                photo_file_id=draft.photo_file_id,
             )
-            await send_stone_map(update, existing_stone.id)
+            logger.info("Added to history (no location) for stone_id=%s", existing_stone.id)
+            await reply_with_stone_map(update, t("saved_no_location", update), existing_stone, history)
         else:
-            stone_id = await register_stone(context.user_data, update.effective_user.id)
-            logger.info(f"Registered new stone (no location): {context.user_data['name']} (ID: {stone_id})")
+            stone_id = await register_stone(draft, update.effective_user.id)
+            logger.info("Registered new stone (no location): %s (ID: %s)", draft.name, stone_id)
             await update.message.reply_text(
-                t("stone_registered", update, name=context.user_data['name'], id=stone_id),
+                t("stone_registered", update, name=draft.name, id=stone_id),
                 reply_markup=ReplyKeyboardRemove(),
             )
 
         return ConversationHandler.END
 
     except Exception as e:
-        logger.error(f"Error in handle_skip_location: {e}", exc_info=True)
+        logger.error("Error in handle_skip_location: %s", e, exc_info=True)
         await update.message.reply_text(
             t("error_generic", update),
             reply_markup=ReplyKeyboardRemove()
@@ -680,50 +834,68 @@ async def handle_skip_location(update: Update, context: ContextTypes.DEFAULT_TYP
         return ConversationHandler.END
 
 
-async def send_stone_map(update: Update, stone_id: int) -> None:
-    """Send map image for stone history."""
-    await _send_stone_map_impl(update.message, update.effective_user.id, stone_id)
+async def reply_with_stone_map(update: Update, text: str, stone: StoneMatch, history: list) -> None:
+    """Send the confirmation text and the history map concurrently.
 
+    The map is rendered (OSM tiles) before it is sent, so the text still
+    arrives first.
+    """
+    async with asyncio.TaskGroup() as tg:
+        tg.create_task(update.message.reply_text(text, reply_markup=ReplyKeyboardRemove()))
+        tg.create_task(send_stone_map(update, stone, history))
 
-async def send_stone_map_from_query(query, stone_id: int) -> None:
-    """Send map image for stone history from callback query."""
-    await _send_stone_map_impl(query.message, query.from_user.id, stone_id)
 
+@lru_cache(maxsize=1024)
+def _map_markup(stone_id: int, lang: str) -> InlineKeyboardMarkup | None:
+    """"Interactive map" Mini App button for a stone (None without a webapp URL)."""
+    if not WEBAPP_MAP_URL:
+        return None
+    webapp_url = f"{WEBAPP_MAP_URL}?stone_id={stone_id}"
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(
+            TEXTS[lang]["interactive_map"],
+            web_app=WebAppInfo(url=webapp_url)
+        )]
+    ])
+
+
+async def send_stone_map(update: Update, stone: Stone | StoneMatch, history: list | None = None) -> None:
+    """Send map image for stone history."""
+    await _send_stone_map_impl(update.message, update.effective_user.id, stone, history)
 
-async def _send_stone_map_impl(message, user_id: int, stone_id: int) -> None:
-    """Internal implementation for sending stone map."""
-    try:
-        async with async_session() as session:
-            result = await session.execute(
-                select(Stone)
-                .options(selectinload(Stone.history))
-                .where(Stone.id == stone_id)
-            )
-            stone = result.scalar_one_or_none()
 
-            if stone and stone.history:
-                map_image = generate_stone_map_image(stone.history, stone.name)
+async def _send_stone_map_impl(message, user_id: int, stone: Stone | StoneMatch, history: list | None) -> None:
+    """Internal implementation for sending stone map.
+
+    Uses history passed by the caller if it already has it loaded,
+    otherwise loads the stone's history rows.
+    """
+    try:
+        if history is None:
+            async with async_session() as session:
+                history = await _load_history(session, stone.id)
+
+        if history:
+            map_key = (stone.id, len(history), max(h.id for h in history))
+            map_image = _map_cache.get(map_key)
+            if map_image is not None:
+                _map_cache.move_to_end(map_key)
+            else:
+                # staticmap downloads OSM tiles synchronously: keep it off the event loop
+                png = await asyncio.to_thread(generate_stone_map_image, history, stone.name)
+                map_image = InputFile(png, filename="map.png") if png else None
                 if map_image:
-                    if settings.webapp_base_url:
-                        webapp_url = f"{settings.webapp_base_url}/static/index.html?stone_id={stone_id}"
-                        keyboard = InlineKeyboardMarkup([
-                            [InlineKeyboardButton(
-                                get_text("interactive_map", user_id),
-                                web_app=WebAppInfo(url=webapp_url)
-                            )]
-                        ])
-                        await message.reply_photo(
-                            photo=BytesIO(map_image),
-                            caption=get_text("map_caption", user_id),
-                            reply_markup=keyboard,
-                        )
-                    else:
-                        await message.reply_photo(
-                            photo=BytesIO(map_image),
-                            caption=get_text("map_caption", user_id)
-                        )
+                    _map_cache[map_key] = map_image
+                    if len(_map_cache) > MAP_CACHE_SIZE:
+                        _map_cache.popitem(last=False)
+            if map_image:
+                await message.reply_photo(
+                    photo=map_image,
+                    caption=get_text("map_caption", user_id),
+                    reply_markup=_map_markup(stone.id, get_user_language(user_id)),
+                )
     except Exception as e:
-        logger.error(f"Error sending map: {e}", exc_info=True)
+        logger.error("Error sending map: %s", e, exc_info=True)
 
 
 async def handle_location_fallback(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
@@ -732,18 +904,12 @@ async def handle_location_fallback(update: Update, context: ContextTypes.DEFAULT
     text_lower = text.lower()
     user_id = update.effective_user.id
 
-    # Get translated button texts for comparison
-    btn_skip = get_text("btn_skip", user_id).lower()
-    btn_zip = get_text("btn_enter_zip", user_id).lower()
-
     # Accept variations of "skip" in all languages
-    skip_variants = ["пропустить", "skip", "pomiń", "пропуск", "-", "нет", "no", "nie"]
-    if text_lower == btn_skip or text_lower in skip_variants:
+    if text_lower in SKIP_VARIANTS:
         return await handle_skip_location(update, context)
 
     # User wants to enter ZIP code
-    zip_variants = ["ввести zip код", "ввести zip", "zip", "zip код", "enter zip", "wpisz kod"]
-    if text_lower == btn_zip or text_lower in zip_variants:
+    if text_lower in ZIP_VARIANTS:
         await update.message.reply_text(
             t("enter_zip", update),
             reply_markup=get_skip_keyboard(user_id),
@@ -751,33 +917,33 @@ async def handle_location_fallback(update: Update, context: ContextTypes.DEFAULT
         return WAITING_LOCATION
 
     # Check if input looks like a ZIP code
-    if len(text) >= 3 and len(text) <= 10 and text.replace("-", "").replace(" ", "").isalnum():
+    if ZIP_CODE_RE.fullmatch(text):
         coords = await get_coords_from_zip(text)
         lat, lon = coords if coords else (None, None)
 
-        context.user_data["zip_code"] = text
-        context.user_data["latitude"] = lat
-        context.user_data["longitude"] = lon
+        draft = get_draft(context)
+        draft.zip_code = text
+        draft.latitude = lat
+        draft.longitude = lon
 
-        existing_stone = context.user_data.get("existing_stone")
+        existing_stone = draft.existing_stone
 
         if existing_stone:
-            await add_to_history(
+            msg = t("saved_to_history", update) + "\n" + t("zip_label", update, zip=text)
+            if lat and lon:
+                msg += "\n" + t("coords_label", update, lat=lat, lon=lon)
+            history = await add_to_history(
                 stone_id=existing_stone.id,
                 user_id=user_id,
-                photo_file_id=context.user_data["photo_file_id"],
+                photo_file_id=draft.photo_file_id,
                 latitude=lat,
                 longitude=lon,
                 zip_code=text,
             )
-            msg = t("saved_to_history", update) + "\n" + t("zip_label", update, zip=text)
-            if lat and lon:
-                msg += "\n" + t("coords_label", update, lat=lat, lon=lon)
-            await update.message.reply_text(msg, reply_markup=ReplyKeyboardRemove())
-            await send_stone_map(update, existing_stone.id)
+            await reply_with_stone_map(update, msg, existing_stone, history)
         else:
-            stone_id = await register_stone(context.user_data, user_id)
-            msg = t("stone_registered", update, name=context.user_data['name'], id=stone_id)
+            stone_id = await register_stone(draft, user_id)
+            msg = t("stone_registered", update, name=draft.name, id=stone_id)
             msg += "\n" + t("zip_label", update, zip=text)
             if lat and lon:
                 msg += "\n" + t("coords_label", update, lat=lat, lon=lon)
@@ -795,81 +961,104 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     return ConversationHandler.END
 
 
-async def find_similar_stone(embedding: list[float]) -> Stone | None:
-    """Find stone with similar embedding using cosine similarity.
+async def find_stone_by_photo(photo_file_id: str) -> StoneMatch | None:
+    """Stone whose history already contains this Telegram photo (indexed lookup).
 
-    Uses HNSW index for O(log n) search instead of O(n).
+    Returns None on errors too: the caller falls back to the CLIP search.
     """
     try:
         async with async_session() as session:
-            # Convert embedding to PostgreSQL array format
-            embedding_str = "[" + ",".join(str(x) for x in embedding) + "]"
+            result = await session.execute(_STONE_BY_PHOTO, {"photo_file_id": photo_file_id})
+            row = result.one_or_none()
+    except Exception as e:
+        logger.error("Photo lookup error: %s", e, exc_info=True)
+        return None
+    return StoneMatch(*row, similarity=1.0) if row else None
 
-            # Use raw SQL with text() to properly pass vector parameter
-            # This allows pgvector to use the HNSW index for fast ANN search
-            from sqlalchemy import text, bindparam
 
-            result = await session.execute(
-                text("""
-                    SELECT id, name, description, photo_file_id, embedding,
-                           registered_by_user_id, created_at,
-                           1 - (embedding <=> CAST(:embedding AS vector)) as similarity
-                    FROM stones
-                    WHERE embedding IS NOT NULL
-                    ORDER BY embedding <=> CAST(:embedding AS vector)
-                    LIMIT 1
-                """).bindparams(bindparam("embedding", value=embedding_str, literal_execute=True))
-            )
-            row = result.fetchone()
+async def find_similar_stone(embedding: np.ndarray | list[float]) -> StoneMatch | None:
+    """Find stone with similar embedding using cosine similarity.
+
+    Uses HNSW index for O(log n) search instead of O(n): top ANN_CANDIDATES
+    by Hamming distance of sign bits, then exact cosine rerank.
+    Returns StoneMatch or None.
+    """
+    # No-op for the float32 arrays from CLIPService, converts lists
+    embedding = np.asarray(embedding, dtype=np.float32)
+
+    # Convert embedding to PostgreSQL array format. tolist() gives
+    # plain Python floats: str() on them is much cheaper than on
+    # numpy float32 scalars one by one
+    embedding_str = "[" + ",".join(map(str, embedding.tolist())) + "]"
+
+    try:
+        async with async_session() as session:
+            result = await session.execute(_SIMILAR_STONE, {"embedding": embedding_str})
+            row = result.one_or_none()
 
             if not row:
                 return None
 
-            similarity = row.similarity
+            stone_id, name, description, history_count, distance = row
+            similarity = 1 - distance
 
             if similarity >= SIMILARITY_THRESHOLD:
-                # Load the full Stone object with history
-                stone_result = await session.execute(
-                    select(Stone)
-                    .options(selectinload(Stone.history))
-                    .where(Stone.id == row.id)
-                )
-                stone = stone_result.scalar_one()
-                logger.info(f"Match: {stone.name} (sim={similarity:.4f})")
-                return stone
+                logger.info("Match: %s (sim=%.4f)", name, similarity)
+                return StoneMatch(stone_id, name, description, history_count, similarity)
             else:
-                logger.info(f"No match (best={similarity:.4f}, threshold={SIMILARITY_THRESHOLD})")
+                logger.info("No match (best=%.4f, threshold=%s)", similarity, SIMILARITY_THRESHOLD)
                 return None
 
     except Exception as e:
-        logger.error(f"Similarity search error: {e}", exc_info=True)
+        logger.error("Similarity search error: %s", e, exc_info=True)
         return None
 
 
-async def register_stone(data: dict, user_id: int) -> int:
-    """Register new stone and add first history entry. Returns stone ID."""
-    async with async_session() as session:
-        stone = Stone(
-            name=data["name"],
-            description=data.get("description"),
-            photo_file_id=data["photo_file_id"],
-            embedding=data["embedding"],
+async def register_stone(draft: StoneDraft, user_id: int) -> int:
+    """Register new stone and add first history entry. Returns stone ID.
+
+    Both rows go in with one statement (INSERT ... RETURNING as a CTE
+    feeding INSERT ... SELECT) instead of flush + second INSERT. created_at
+    comes from the column default now(), the same transaction timestamp for
+    both rows.
+    """
+    history_columns = StoneHistory.__table__.c
+
+    new_stone = (
+        insert(Stone)
+        .values(
+            name=draft.name,
+            description=draft.description,
+            photo_file_id=draft.photo_file_id,
+            embedding=draft.embedding,
             registered_by_user_id=user_id,
         )
-        session.add(stone)
-        await session.flush()
+        .returning(Stone.id)
+        .cte("new_stone")
+    )
+    values = {
+        "telegram_user_id": user_id,
+        "photo_file_id": draft.photo_file_id,
+        "latitude": draft.latitude,
+        "longitude": draft.longitude,
+        "zip_code": draft.zip_code,
+    }
 
-        history = StoneHistory(
-            stone_id=stone.id,
-            telegram_user_id=user_id,
-            photo_file_id=data["photo_file_id"],
-            latitude=data.get("latitude"),
-            longitude=data.get("longitude"),
-            zip_code=data.get("zip_code"),
+    async with async_session() as session:
+        result = await session.execute(
+            insert(StoneHistory)
+            .from_select(
+                ["stone_id", *values],
+                select(
+                    new_stone.c.id,
+                    *(literal(value, history_columns[name].type) for name, value in values.items()),
+                ),
+            )
+            .returning(StoneHistory.stone_id)
         )
-        session.add(history)
+        stone_id = result.scalar_one()
         await session.commit()
-        return stone.id
+        return stone_id
 
 
 async def add_to_history(
@@ -879,8 +1068,12 @@ async def add_to_history(
     latitude: float = None,
     longitude: float = None,
     zip_code: str = None,
-) -> None:
-    """Add entry to stone history."""
+) -> list[StoneHistory]:
+    """Add entry to stone history.
+
+    Returns the stone's full history (newest first), read in the same
+    session, so the map can be drawn without another pool checkout.
+    """
     async with async_session() as session:
         history = StoneHistory(
             stone_id=stone_id,
@@ -891,7 +1084,11 @@ async def add_to_history(
             zip_code=zip_code,
         )
         session.add(history)
+        await session.flush()
+
+        rows = await _load_history(session, stone_id)
         await session.commit()
+        return rows
 
 
 def setup_handlers(app: Application) -> None:
@@ -915,9 +1112,9 @@ def setup_handlers(app: Application) -> None:
     app.add_handler(CommandHandler("mine", mine_command))
     app.add_handler(CommandHandler("info", info_command))
     app.add_handler(CommandHandler("delete", delete_command))
-    app.add_handler(CallbackQueryHandler(lang_callback, pattern="^lang:"))
-    app.add_handler(CallbackQueryHandler(mine_page_callback, pattern="^mine_page:"))
-    app.add_handler(CallbackQueryHandler(stone_info_callback, pattern="^stone_info:"))
-    app.add_handler(CallbackQueryHandler(delete_ask_callback, pattern="^delete_ask:"))
-    app.add_handler(CallbackQueryHandler(delete_callback, pattern="^delete_confirm:|^delete_cancel:"))
+    app.add_handler(CallbackQueryHandler(lang_callback, pattern=LANG_CB_RE))
+    app.add_handler(CallbackQueryHandler(mine_page_callback, pattern=MINE_PAGE_CB_RE))
+    app.add_handler(CallbackQueryHandler(stone_info_callback, pattern=STONE_INFO_CB_RE))
+    app.add_handler(CallbackQueryHandler(delete_ask_callback, pattern=DELETE_ASK_CB_RE))
+    app.add_handler(CallbackQueryHandler(delete_callback, pattern=DELETE_CB_RE))
     app.add_handler(conv_handler)
@@ -10,6 +10,16 @@ class Settings(BaseSettings):
     postgres_host: str = "localhost"
     postgres_port: int = 5432
 
+    # rembg background removal model: u2netp (4.7 MB, ~4x faster) or u2net (176 MB)
+    rembg_model: str = "u2netp"
+
+    # HNSW index on stones.embedding: m / ef_construction are used when the
+    # index is created (drop it to rebuild), ef_search on every bot connection
+    # (must be >= ANN_CANDIDATES in handlers, or HNSW returns fewer rows)
+    hnsw_m: int = 16
+    hnsw_ef_construction: int = 64
+    hnsw_ef_search: int = 100
+
     # Web server for Mini App
     web_port: int = 8080
     webapp_base_url: str = ""  # HTTPS URL from ngrok/cloudflared
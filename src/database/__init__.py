@@ -1,3 +1,3 @@
-from .connection import get_session, init_db
+from .connection import get_session, init_db, warm_up_pool
 
-__all__ = ["get_session", "init_db"]
+__all__ = ["get_session", "init_db", "warm_up_pool"]
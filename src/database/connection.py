@@ -1,10 +1,34 @@
+import asyncio
+
 from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
 from sqlalchemy import text
 
 from src.config import settings
 from src.database.models import Base
 
-engine = create_async_engine(settings.database_url, echo=False)
+# Connections opened at startup by warm_up_pool()
+DB_POOL_SIZE = 10
+
+# binary_quantize / bit_hamming_ops (ANN index), l2_normalize / vector_norm
+MIN_PGVECTOR_VERSION = (0, 7)
+
+engine = create_async_engine(
+    settings.database_url,
+    echo=False,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=20,
+    # No SELECT 1 per checkout; recycle instead of probing for stale connections
+    pool_pre_ping=False,
+    pool_recycle=1800,
+    # Fail a handler fast instead of queueing 30 s behind a saturated pool
+    pool_timeout=10,
+    connect_args={"server_settings": {
+        # HNSW candidate list size for ANN queries (pgvector default is 40)
+        "hnsw.ef_search": str(settings.hnsw_ef_search),
+        # Queries are tiny: JIT compilation would only add latency
+        "jit": "off",
+    }},
+)
 async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
 
 
@@ -13,16 +37,110 @@ async def get_session() -> AsyncSession:
         yield session
 
 
+async def warm_up_pool() -> None:
+    """Open DB_POOL_SIZE connections up front so first handlers skip connect + auth."""
+    connections = await asyncio.gather(*(engine.connect().start() for _ in range(DB_POOL_SIZE)))
+    await asyncio.gather(*(conn.close() for conn in connections))
+
+
 async def init_db():
     """Initialize database, create tables and indexes."""
     async with engine.begin() as conn:
+        # init.sql only runs when the Postgres volume is first created;
+        # the vector type and HNSW index below need the extension
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS vector"))
+        # CREATE ... IF NOT EXISTS leaves an extension created by an older
+        # image on the data volume at its old version: bring it up to the
+        # version the server ships
+        await conn.execute(text("ALTER EXTENSION vector UPDATE"))
+        version = (await conn.execute(
+            text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+        )).scalar_one()
+        if tuple(int(part) for part in version.split(".")[:2]) < MIN_PGVECTOR_VERSION:
+            raise RuntimeError(
+                f"pgvector {version} is too old, >= "
+                f"{'.'.join(map(str, MIN_PGVECTOR_VERSION))} is required: "
+                "update the pgvector/pgvector image"
+            )
         await conn.run_sync(Base.metadata.create_all)
 
-        # Create HNSW index for fast vector similarity search
-        # This index dramatically speeds up cosine similarity queries
+        # Migrate existing stone_history FK to ON DELETE CASCADE
+        # (create_all doesn't alter constraints of existing tables)
+        await conn.execute(text("""
+            DO $$
+            BEGIN
+                IF EXISTS (
+                    SELECT 1 FROM pg_constraint
+                    WHERE conname = 'stone_history_stone_id_fkey' AND confdeltype <> 'c'
+                ) THEN
+                    ALTER TABLE stone_history
+                        DROP CONSTRAINT stone_history_stone_id_fkey,
+                        ADD CONSTRAINT stone_history_stone_id_fkey
+                            FOREIGN KEY (stone_id) REFERENCES stones(id) ON DELETE CASCADE;
+                END IF;
+            END $$
+        """))
+
+        # Timestamps are filled in by Postgres (server_default now()); create_all
+        # only sets the default on new tables
+        for table, column in (
+            ("documents", "created_at"),
+            ("stones", "created_at"),
+            ("stone_history", "created_at"),
+            ("user_settings", "created_at"),
+            ("user_settings", "updated_at"),
+        ):
+            await conn.execute(text(f"ALTER TABLE {table} ALTER COLUMN {column} SET DEFAULT now()"))
+
+        # Indexes declared on the models (create_all only adds them to new tables):
+        # lookup of already registered photos, /mine pagination per owner,
+        # per-stone history newest first
+        await conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_stone_history_photo_file_id ON stone_history (photo_file_id)"
+        ))
+        await conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_stones_registered_by_user_id_id ON stones (registered_by_user_id, id)"
+        ))
+        await conn.execute(text(
+            "CREATE INDEX IF NOT EXISTS ix_stone_history_stone_id_created_at"
+            " ON stone_history (stone_id, created_at DESC)"
+        ))
+
+        # Every stone is registered with an embedding: enforce it so the ANN
+        # query needs no IS NOT NULL filter (skipped while legacy NULLs remain)
         await conn.execute(text("""
-            CREATE INDEX IF NOT EXISTS stones_embedding_hnsw_idx
-            ON stones
-            USING hnsw (embedding vector_cosine_ops)
-            WITH (m = 16, ef_construction = 64)
+            DO $$
+            BEGIN
+                IF NOT EXISTS (SELECT 1 FROM stones WHERE embedding IS NULL) THEN
+                    ALTER TABLE stones ALTER COLUMN embedding SET NOT NULL;
+                END IF;
+            END $$
         """))
+
+        # One-off migration to inner-product search, run when the bit index
+        # doesn't exist yet (new rows are stored unit length by CLIPService)
+        bit_index_missing = (await conn.execute(
+            text("SELECT to_regclass('stones_embedding_bit_hnsw_idx') IS NULL")
+        )).scalar_one()
+        if bit_index_missing:
+            # The inner product equals cosine only for unit vectors: normalize
+            # rows stored before embeddings were re-normalized in FP32 (zero
+            # vectors have no direction and are left as they are)
+            await conn.execute(text("""
+                UPDATE stones SET embedding = l2_normalize(embedding)
+                WHERE vector_norm(embedding) > 0
+                  AND abs(vector_norm(embedding) - 1) > 1e-6
+            """))
+
+            # HNSW index for fast vector similarity search on the
+            # binary-quantized expression (1 bit per dimension, 32x smaller
+            # than float32): it only picks candidates, exact distance for
+            # reranking is computed from the float32 column
+            await conn.execute(text("DROP INDEX IF EXISTS stones_embedding_hnsw_idx"))
+            await conn.execute(text("DROP INDEX IF EXISTS stones_embedding_halfvec_hnsw_idx"))
+            await conn.execute(text(f"""
+                CREATE INDEX stones_embedding_bit_hnsw_idx
+                ON stones
+                USING hnsw ((binary_quantize(embedding)::bit(512)) bit_hamming_ops)
+                WITH (m = {settings.hnsw_m}, ef_construction = {settings.hnsw_ef_construction})
+            """))
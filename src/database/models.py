@@ -1,7 +1,6 @@
-from datetime import datetime
-from sqlalchemy import Column, Integer, Text, DateTime, Float, String, ForeignKey
+from sqlalchemy import Column, Integer, Text, DateTime, Float, String, ForeignKey, Index, select, func
 from sqlalchemy.dialects.postgresql import JSONB
-from sqlalchemy.orm import declarative_base, relationship
+from sqlalchemy.orm import declarative_base, relationship, column_property
 from pgvector.sqlalchemy import Vector
 
 Base = declarative_base()
@@ -14,7 +13,7 @@ class Document(Base):
     content = Column(Text, nullable=False)
     embedding = Column(Vector(1536))
     doc_metadata = Column(JSONB)
-    created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 
 class Stone(Base):
@@ -24,34 +23,60 @@ class Stone(Base):
     name = Column(String(255), nullable=False)
     description = Column(Text, nullable=True)
     photo_file_id = Column(String(255), nullable=False)
-    embedding = Column(Vector(512))  # CLIP ViT-B/32 produces 512-dim vectors
+    embedding = Column(Vector(512), nullable=False)  # CLIP ViT-B/32 produces 512-dim vectors
     registered_by_user_id = Column(Integer, nullable=False)
-    created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     # Relationship to history
-    history = relationship("StoneHistory", back_populates="stone", order_by="desc(StoneHistory.created_at)")
+    history = relationship(
+        "StoneHistory",
+        back_populates="stone",
+        order_by="desc(StoneHistory.created_at)",
+        passive_deletes=True,  # ON DELETE CASCADE in the DB removes history
+    )
+
+    __table_args__ = (
+        # /mine: WHERE registered_by_user_id = ? ORDER BY id LIMIT/OFFSET
+        Index("ix_stones_registered_by_user_id_id", "registered_by_user_id", "id"),
+    )
 
 
 class StoneHistory(Base):
     __tablename__ = "stone_history"
 
     id = Column(Integer, primary_key=True)
-    stone_id = Column(Integer, ForeignKey("stones.id"), nullable=False)
+    stone_id = Column(Integer, ForeignKey("stones.id", ondelete="CASCADE"), nullable=False)
     telegram_user_id = Column(Integer, nullable=False)
-    photo_file_id = Column(String(255), nullable=False)
+    photo_file_id = Column(String(255), nullable=False, index=True)
     latitude = Column(Float, nullable=True)
     longitude = Column(Float, nullable=True)
     zip_code = Column(String(20), nullable=True)
-    created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
 
     # Relationship to stone
     stone = relationship("Stone", back_populates="history")
 
+    __table_args__ = (
+        # Per-stone history newest first (map, Stone.history) and history_count
+        Index("ix_stone_history_stone_id_created_at", "stone_id", created_at.desc()),
+    )
+
+
+# Number of history entries as a correlated subquery, so count-only views
+# don't load every StoneHistory row. Deferred: opt in with undefer().
+Stone.history_count = column_property(
+    select(func.count(StoneHistory.id))
+    .where(StoneHistory.stone_id == Stone.id)
+    .correlate_except(StoneHistory)
+    .scalar_subquery(),
+    deferred=True,
+)
+
 
 class UserSettings(Base):
     __tablename__ = "user_settings"
 
     telegram_user_id = Column(Integer, primary_key=True)
     language = Column(String(10), default="pl")
-    created_at = Column(DateTime(timezone=True), default=datetime.utcnow)
-    updated_at = Column(DateTime(timezone=True), default=datetime.utcnow, onupdate=datetime.utcnow)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    updated_at = Column(DateTime(timezone=True), server_default=func.now(), onupdate=func.now())
@@ -5,6 +5,7 @@ from .translations import (
     load_user_language,
     save_user_language,
     LANGUAGES,
+    TEXTS,
 )
 
 __all__ = [
@@ -14,4 +15,5 @@ __all__ = [
     "load_user_language",
     "save_user_language",
     "LANGUAGES",
+    "TEXTS",
 ]
@@ -1,5 +1,6 @@
 """Simple i18n system for the bot with database persistence."""
 
+from functools import lru_cache
 from typing import Dict
 
 # Supported languages
@@ -49,6 +50,10 @@ async def load_user_language(user_id: int) -> str:
             if settings and settings.language in LANGUAGES:
                 _user_languages[user_id] = settings.language
                 return settings.language
+
+            # No saved preference: cache the default too, otherwise every
+            # command of such a user queries the DB again
+            _user_languages[user_id] = DEFAULT_LANGUAGE
     except Exception:
         pass
 
@@ -84,10 +89,15 @@ async def save_user_language(user_id: int, lang: str) -> None:
         _user_languages[user_id] = lang
 
 
+@lru_cache(maxsize=None)
+def _get_template(key: str, lang: str) -> str:
+    """Resolve raw template for (key, lang). TEXTS is static, so never stale."""
+    return TEXTS.get(lang, TEXTS[DEFAULT_LANGUAGE]).get(key, key)
+
+
 def get_text(key: str, user_id: int, **kwargs) -> str:
     """Get translated text for user's language."""
-    lang = get_user_language(user_id)
-    text = TEXTS.get(lang, TEXTS[DEFAULT_LANGUAGE]).get(key, key)
+    text = _get_template(key, get_user_language(user_id))
     if kwargs:
         text = text.format(**kwargs)
     return text
@@ -5,9 +5,9 @@ from telegram.ext import Application
 
 from src.config import settings
 from src.bot import setup_handlers
-from src.database import init_db
+from src.database import init_db, warm_up_pool
 from src.web import start_web_server
-from src.services.clip_service import get_clip_service
+from src.services.clip_service import get_clip_service, run_clip
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
@@ -22,17 +22,18 @@ logging.getLogger("httpx").setLevel(logging.WARNING)
 async def post_init(application: Application) -> None:
     """Initialize services after bot startup."""
     await init_db()
+    await warm_up_pool()
     logger.info("Database initialized")
 
     # Pre-load CLIP model (heavy, do it once at startup)
+    # (on the CLIP worker thread, where inference will run)
     logger.info("Loading CLIP model...")
-    get_clip_service()
+    clip = await run_clip(get_clip_service)
     logger.info("CLIP model loaded")
 
     # Pre-load rembg model (also heavy, loads U2-Net on first use)
     logger.info("Loading rembg model...")
-    from rembg import new_session
-    new_session("u2net")
+    await run_clip(lambda: clip.rembg_session)
     logger.info("rembg model loaded")
 
     # Set bot commands menu for each language
@@ -76,9 +77,15 @@ def main() -> None:
     # Start web server for Mini App
     start_web_server(port=settings.web_port)
 
+    # PTB keeps one persistent httpx client, but its default pool is a single
+    # connection: replies, photo uploads and file downloads queue behind it
     app = (
         Application.builder()
         .token(settings.telegram_bot_token)
+        .connection_pool_size(16)
+        .connect_timeout(5.0)
+        .read_timeout(20.0)
+        .pool_timeout(5.0)
         .post_init(post_init)
         .build()
     )
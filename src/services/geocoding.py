@@ -1,17 +1,52 @@
 import httpx
 import logging
+import time
 
 logger = logging.getLogger(__name__)
 
 NOMINATIM_REVERSE_URL = "https://nominatim.openstreetmap.org/reverse"
 NOMINATIM_SEARCH_URL = "https://nominatim.openstreetmap.org/search"
 
+# In-memory cache for geocoding results (successful lookups only)
+CACHE_TTL = 24 * 3600  # seconds
+CACHE_MAX_SIZE = 10_000
+GPS_CACHE_PRECISION = 3  # decimal places, ~100 m cell
+
+_reverse_cache: dict[tuple[float, float], tuple[float, dict]] = {}
+_zip_cache: dict[str, tuple[float, tuple[float, float]]] = {}
+
+
+def _cache_get(cache: dict, key):
+    """Get cached value or None if missing/expired."""
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    stored_at, value = entry
+    if time.monotonic() - stored_at > CACHE_TTL:
+        del cache[key]
+        return None
+    return value
+
+
+def _cache_put(cache: dict, key, value) -> None:
+    """Store value, evicting the oldest entry when full."""
+    cache.pop(key, None)
+    if len(cache) >= CACHE_MAX_SIZE:
+        del cache[next(iter(cache))]
+    cache[key] = (time.monotonic(), value)
+
 
 async def get_location_from_gps(lat: float, lon: float) -> dict | None:
     """Get location info (ZIP, city, country) from GPS coordinates using Nominatim.
 
     Returns dict with: zip_code, city, country, display_name
     """
+    cache_key = (round(lat, GPS_CACHE_PRECISION), round(lon, GPS_CACHE_PRECISION))
+    cached = _cache_get(_reverse_cache, cache_key)
+    if cached is not None:
+        logger.info(f"Geocoding {lat}, {lon} -> {cached} (cached)")
+        return cached
+
     try:
         async with httpx.AsyncClient() as client:
             response = await client.get(
@@ -40,6 +75,7 @@ async def get_location_from_gps(lat: float, lon: float) -> dict | None:
             }
 
             logger.info(f"Geocoding {lat}, {lon} -> {result}")
+            _cache_put(_reverse_cache, cache_key, result)
             return result
 
     except Exception as e:
@@ -52,6 +88,12 @@ async def get_coords_from_zip(zip_code: str) -> tuple[float, float] | None:
 
     Returns (latitude, longitude) or None if not found.
     """
+    cache_key = zip_code.strip().upper()
+    cached = _cache_get(_zip_cache, cache_key)
+    if cached is not None:
+        logger.info(f"ZIP geocoding {zip_code} -> {cached[0]}, {cached[1]} (cached)")
+        return cached
+
     try:
         async with httpx.AsyncClient() as client:
             response = await client.get(
@@ -73,6 +115,7 @@ async def get_coords_from_zip(zip_code: str) -> tuple[float, float] | None:
                 lat = float(data[0]["lat"])
                 lon = float(data[0]["lon"])
                 logger.info(f"ZIP geocoding {zip_code} -> {lat}, {lon}")
+                _cache_put(_zip_cache, cache_key, (lat, lon))
                 return lat, lon
 
             logger.warning(f"ZIP geocoding {zip_code} -> not found")